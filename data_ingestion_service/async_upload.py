@@ -0,0 +1,195 @@
+"""Module for uploading files to DIIP API concurrently with asyncio, using presigned S3 URLs."""
+
+__all__ = ["AsyncDIIPUploader", "upload_many"]
+
+import asyncio
+import io
+import logging
+import time
+from typing import Iterable, Mapping
+
+try:
+    import aiohttp
+except ImportError:  # Optional "async" extra.
+    aiohttp = None
+
+from data_ingestion_service.upload import DIIPUploader, _LOCAL_FILE_BUFFER_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDIIPUploader:
+    """
+    An async context manager for uploading files to S3 via DIIP ingest API.
+    Entity URL requests and S3 uploads of many files run concurrently over one connection pool.
+    The upload session is initialized when entering the context and completed when exiting.
+    Usage example:
+        async with AsyncDIIPUploader(base_url, api_key) as uploader:
+            await uploader.upload_many({entity_name: [file_path, ...]})
+    Attributes:
+        - base_url (str): The base URL of the DIIP API. It is different per environment.
+        - api_key (str): The API key for authentication received from TV3 as secret.
+    """
+
+    def __init__(self, base_url: str, api_key: str, max_connections: int = 32):
+        """
+        Initialize the uploader.
+
+        Args:
+            base_url (str): The base URL of the DIIP API.
+            api_key (str): The API key for authentication.
+            max_connections (int): Maximum number of simultaneous connections and in-flight uploads.
+        """
+        if aiohttp is None:
+            raise ImportError("AsyncDIIPUploader requires aiohttp. Install the 'async' extra.")
+        self.base_url: str = base_url
+        self.api_key: str = api_key
+        self.max_connections: int = max_connections
+        self.data_package_id: str | None = None
+        # Presigned entity URLs keyed by "<dataPackageId>:<entity_name>", as they are only valid for their own session.
+        self._entity_url_cache: dict[str, tuple[dict, float]] = {}
+        # Sent only to the DIIP API, never to S3.
+        self._headers: dict[str, str] = {"x-api-key": api_key}
+        self._session: "aiohttp.ClientSession | None" = None
+
+    async def __aenter__(self) -> "AsyncDIIPUploader":
+        """
+        Enter the context manager, open the HTTP session and initialize the upload session.
+
+        Returns:
+            AsyncDIIPUploader: The uploader instance.
+        """
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections),
+            # No total limit, as large uploads may take long; connect and read waits match DIIPUploader._TIMEOUT.
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=60),
+        )
+        try:
+            self.data_package_id = await self._initialize_upload()
+        except BaseException:
+            await self._session.close()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """
+        Exit the context manager, complete the upload session and close the HTTP session.
+        """
+        try:
+            if self.data_package_id:
+                await self._complete_upload()
+        finally:
+            await self._session.close()
+        if exc_type:
+            logger.error("An error occurred: %s", exc_value)
+        logger.info("Exiting AsyncDIIPUploader context.")
+
+    async def upload_file(self, entity_name: str, file: str | io.BytesIO, file_name: str = None):
+        """
+        Upload a file to the DIIP API on an open session.
+
+        Args:
+            entity_name (str): The name of the entity to associate with the file (e.g., table name, source name, report name).
+            file (str | io.BytesIO): The file to upload, either a local file path or an in-memory file object.
+            file_name (str): File name to be used for the file on the destination after upload.
+                             Optional for the file (str).
+                             Required if `file` is a io.BytesIO object as there is no name associated.
+        """
+        entity_url = await self._get_diip_upload_entity_url(DIIPUploader._clean_name_for_s3(entity_name))
+
+        if isinstance(file, str):  # Local file path
+            file_name = file_name or DIIPUploader._extract_file_name(file)
+            with open(file, "rb", buffering=_LOCAL_FILE_BUFFER_SIZE) as f:
+                await self._upload_to_s3(f, entity_url, file_name)
+        elif isinstance(file, io.BytesIO):
+            if not file_name:
+                raise ValueError("file_name must be provided when uploading a io.BytesIO object.")
+            await self._upload_to_s3(file, entity_url, file_name)
+        else:
+            raise TypeError("file must be a file path (str) or a io.BytesIO object.")
+
+    async def upload_many(self, uploads: Mapping[str, Iterable[str | tuple[io.BytesIO, str]]]):
+        """
+        Upload many files to one or more entities concurrently on an open session.
+
+        Args:
+            uploads (Mapping[str, Iterable[str | tuple]]): Files to upload per entity name. Each file is either
+                                                           a file path (str) or a (file, file_name) pair.
+        """
+        await asyncio.gather(
+            *(self._get_diip_upload_entity_url(DIIPUploader._clean_name_for_s3(name)) for name in uploads)
+        )
+        semaphore = asyncio.Semaphore(self.max_connections)
+
+        async def upload(entity_name, item):
+            async with semaphore:
+                if isinstance(item, tuple):
+                    await self.upload_file(entity_name, *item)
+                else:
+                    await self.upload_file(entity_name, item)
+
+        await asyncio.gather(*(upload(name, item) for name, files in uploads.items() for item in files))
+
+    async def _initialize_upload(self) -> str:
+        """Initialize the upload session and return the dataPackageId. It is happening every time the context manager is entered."""
+        response = await self._api_call("/upload/init")
+        logger.info("Initialized upload session with dataPackageId: %s", response["dataPackageId"])
+        return response["dataPackageId"]
+
+    async def _complete_upload(self):
+        """Complete the upload session. It is happening every time the context manager is exited."""
+        await self._api_call(f"/upload/{self.data_package_id}/complete")
+        logger.info("Upload session completed for dataPackageId: %s", self.data_package_id)
+
+    async def _get_diip_upload_entity_url(self, entity_name: str) -> dict:
+        """Get a DIIP URL for uploading a file, using a cached URL if valid. This is done once per entity."""
+        cache_key = f"{self.data_package_id}:{entity_name}"
+        if cache_key in self._entity_url_cache:
+            cached_url, expiration_time = self._entity_url_cache[cache_key]
+            if time.monotonic() < expiration_time:
+                logger.info("Reusing cached DIIP uploading URL for entity: %s", entity_name)
+                return cached_url
+
+        response = await self._api_call(f"/upload/{self.data_package_id}/entity/{entity_name}")
+        entity_url = response["presignedUrlData"]
+        self._entity_url_cache[cache_key] = (entity_url, time.monotonic() + DIIPUploader._ENTITY_URL_TTL)
+        logger.info("Generated and cached entity URL for entity: %s", entity_name)
+        return entity_url
+
+    async def _upload_to_s3(self, file_obj: io.BufferedReader | io.BytesIO, entity_url: dict, file_name: str):
+        """Upload a file to S3 using the provided entity URL. aiohttp streams the file into the multipart body."""
+        form = aiohttp.FormData()
+        for key, value in entity_url["fields"].items():
+            form.add_field(key, value)
+        form.add_field("file", file_obj, filename=file_name, content_type="application/octet-stream")
+
+        async with self._session.post(entity_url["url"], data=form) as response:
+            if response.status == 204:
+                logger.info("File %s uploaded successfully.", file_name)
+            else:
+                reason = await response.text()
+                logger.error("Failed to upload file %s. Status: %s, Reason: %s", file_name, response.status, reason)
+                raise Exception(f"Failed to upload file {file_name}")
+
+    async def _api_call(self, endpoint: str, method: str = "POST", payload: dict | None = None) -> dict:
+        """Make an API call to the specified endpoint."""
+        url = f"{self.base_url}{endpoint}"
+        async with self._session.request(method, url, headers=self._headers, json=payload) as response:
+            response.raise_for_status()
+            return await response.json()
+
+
+def upload_many(base_url: str, api_key: str, uploads: Mapping[str, Iterable[str | tuple[io.BytesIO, str]]]):
+    """
+    Upload many files concurrently in a single DIIP upload session from synchronous code.
+
+    Args:
+        base_url (str): The base URL of the DIIP API.
+        api_key (str): The API key for authentication.
+        uploads (Mapping[str, Iterable[str | tuple]]): Files to upload per entity name, as for `AsyncDIIPUploader.upload_many`.
+    """
+    async def run():
+        async with AsyncDIIPUploader(base_url, api_key) as uploader:
+            await uploader.upload_many(uploads)
+
+    asyncio.run(run())
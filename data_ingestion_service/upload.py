@@ -3,13 +3,33 @@
 __all__ = ["DIIPUploader"]
 
 import requests
+import functools
+import hashlib
 import io
 import logging
-from datetime import datetime, timedelta
+import os
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Iterable, MutableMapping
 from botocore.response import StreamingBody
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
+
+try:
+    from requests_toolbelt import MultipartEncoder
+except ImportError:  # Optional "streaming" extra; without it multipart bodies are built in memory.
+    MultipartEncoder = None
 
 logger = logging.getLogger(__name__)
 
+# Read buffer for local files, so the multipart body is filled with fewer read() syscalls.
+_LOCAL_FILE_BUFFER_SIZE = 1024 * 1024
+
 
 class DIIPUploader:
     """
@@ -23,18 +43,52 @@ class DIIPUploader:
         - api_key (str): The API key for authentication received from TV3 as secret.
     """
 
-    def __init__(self, base_url: str, api_key: str):
+    # Seconds on the monotonic clock, kept below the lifetime of the presigned URL signature.
+    _ENTITY_URL_TTL = 55 * 60
+    # A presigned POST only accepts the whole file, so a failed upload is retried as a whole.
+    _S3_UPLOAD_ATTEMPTS = 3
+    _S3_UPLOAD_BACKOFF = 0.5
+    # (connect, read) timeouts in seconds for every HTTP call.
+    _TIMEOUT = (5, 60)
+    _S3_TRANS = str.maketrans({" ": "_", "-": "_"})
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        cache: MutableMapping[str, tuple[dict, float]] | None = None,
+        dedup_path: str | None = None,
+        dedup_ttl: float | None = None,
+    ):
         """
         Initialize the uploader.
 
         Args:
             base_url (str): The base URL of the DIIP API.
             api_key (str): The API key for authentication.
+            cache (MutableMapping | None): Store for presigned entity URLs, keyed by "<dataPackageId>:<entity_name>".
+                                           Defaults to a new dict per uploader. As every session has a new
+                                           dataPackageId, URLs are never reused across sessions; sharing a store
+                                           only helps uploaders working on the same data package.
+            dedup_path (str | None): Path of a SQLite file recording uploaded files. When set, files already uploaded
+                                     to the same entity under the same name are skipped, e.g. when re-running
+                                     an ingestion that partially succeeded.
+            dedup_ttl (float | None): Seconds after which a recorded upload no longer counts. None keeps records forever.
         """
         self.base_url: str = base_url
         self.api_key: str = api_key
         self.data_package_id: str | None = None
-        self._entity_url_cache: dict[str, tuple[dict, datetime]] = {}
+        self._entity_url_cache: MutableMapping[str, tuple[dict, float]] = {} if cache is None else cache
+        self._entity_url_lock = threading.Lock()
+        # Sent only to the DIIP API, never to S3.
+        self._headers: dict[str, str] = {"x-api-key": api_key}
+        self._session: requests.Session = self._create_session(base_url)
+        self._dedup_path = dedup_path
+        self._dedup_ttl = dedup_ttl
+        self._dedup: sqlite3.Connection | None = None
+        self._dedup_lock = threading.Lock()
+        # Uploads of the open session, recorded in the dedup database only once the session is completed.
+        self._pending_uploads: dict[str, float] = {}
 
     def __enter__(self) -> "DIIPUploader":
         """
@@ -44,106 +98,401 @@ class DIIPUploader:
             DIIPUploader: The uploader instance.
         """
         self.data_package_id = self._initialize_upload()
+        if self._dedup_path is not None:
+            self._open_dedup()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         """
-        Exit the context manager and complete the upload session.
+        Exit the context manager, complete the upload session and release pooled connections.
         """
-        if self.data_package_id:
-            self._complete_upload()
+        try:
+            if self.data_package_id:
+                self._complete_upload()
+                self._record_pending_uploads()
+        finally:
+            self._session.close()
+            self._close_dedup()
         if exc_type:
-            logger.error(f"An error occurred: {exc_value}")
+            logger.error("An error occurred: %s", exc_value)
         logger.info("Exiting DIIPUploader context.")
 
-    def upload_file(self, entity_name: str, file: str | io.BytesIO | StreamingBody, file_name: str = None):
+    def upload_file(
+        self,
+        entity_name: str,
+        file: str | BinaryIO | StreamingBody,
+        file_name: str = None,
+        force: bool = False,
+    ):
         """
         Upload a file to the DIIP API on an open session.
 
         Args:
             entity_name (str): The name of the entity to associate with the file (e.g., table name, source name, report name).
-            file (str | io.BytesIO | StreamingBody): The file to upload. Can be:
+            file (str | BinaryIO | StreamingBody): The file to upload. Can be:
                 - file path (str): File will be read locally and sent to S3.
-                - object (io.BytesIO): An in-memory file object (e.g., already open file).
+                - object (BinaryIO): Any binary file-like object (e.g., io.BytesIO or an already open file).
                 - object (StreamingBody): An object from boto3 S3 client (e.g., response from get_object).
             file_name (str): File name to be used for the file on the destination after upload.
                              Optional for the file (str).
-                             Required if `file` is a io.BytesIO or StreamingBody object as there is no name associated.
+                             Required if `file` is a file-like or StreamingBody object as there is no name associated.
+            force (bool): Upload even if the file is recorded as already uploaded. Only relevant with `dedup_path`.
         """
+        dedup_key = None if force or self._dedup is None else self._dedup_key(entity_name, file, file_name)
+        if dedup_key is not None and self._is_uploaded(dedup_key):
+            logger.info("Skipping file %s for entity %s, already uploaded.", file_name or file, entity_name)
+            return
+
         entity_url = self._get_diip_upload_entity_url(self._clean_name_for_s3(entity_name))
+        handler = getattr(self, self._UPLOAD_HANDLERS.get(type(file), "_upload_other"))
+        handler(file, entity_url, file_name)
 
-        if isinstance(file, str):  # Local file path
+        if dedup_key is not None:
+            self._mark_uploaded(dedup_key)
+
+    def _dedup_key(self, entity_name: str, file: str | BinaryIO | StreamingBody, file_name: str | None) -> str | None:
+        """
+        Build the dedup key of a file from the entity, the file name and a fingerprint of its size and first 4 KiB.
+        Returns None for streams that cannot be fingerprinted without consuming them, which are never skipped.
+        """
+        if isinstance(file, str):
             file_name = file_name or self._extract_file_name(file)
             with open(file, "rb") as f:
-                self._upload_to_s3(f, entity_url, file_name)
-        elif isinstance(file, (io.BytesIO, StreamingBody)):  # In-memory or StreamingBody
-            if not file_name:
-                raise ValueError("file_name must be provided when uploading a io.BytesIO or StreamingBody object.")
-            if isinstance(file, StreamingBody):
-                file = self._convert_streaming_body_to_bytesio(file)
-            self._upload_to_s3(file, entity_url, file_name)
+                fingerprint = self._fingerprint(f)
+        elif file_name and getattr(file, "seekable", None) is not None and file.seekable():
+            fingerprint = self._fingerprint(file)
         else:
-            raise TypeError("file must be a file path (str), a io.BytesIO object, or a StreamingBody object.")
+            return None
+        return f"{entity_name}:{file_name}:{fingerprint}"
+
+    @staticmethod
+    def _fingerprint(file: BinaryIO) -> str:
+        """Hash the size and the first 4 KiB of a seekable file, leaving its position unchanged."""
+        position = file.tell()
+        head = file.read(4096)
+        size = file.seek(0, io.SEEK_END) - position
+        file.seek(position)
+        return hashlib.sha256(head + size.to_bytes(8, "little")).hexdigest()
+
+    def _open_dedup(self):
+        """Open the dedup database for the upload session. It is happening every time the context manager is entered."""
+        self._dedup = sqlite3.connect(self._dedup_path, check_same_thread=False)
+        with self._dedup:
+            self._dedup.execute("CREATE TABLE IF NOT EXISTS uploaded_files (key TEXT PRIMARY KEY, uploaded_at REAL)")
+
+    def _close_dedup(self):
+        """Close the dedup database and drop uploads that were not recorded. It is happening every time the context manager is exited."""
+        self._pending_uploads.clear()
+        if self._dedup is not None:
+            self._dedup.close()
+            self._dedup = None
+
+    def _is_uploaded(self, dedup_key: str) -> bool:
+        """Check whether a file with this dedup key was uploaded in this session or recorded within the dedup TTL."""
+        # Wall-clock time, as records outlive the process.
+        cutoff = time.time() - self._dedup_ttl if self._dedup_ttl is not None else float("-inf")
+        with self._dedup_lock:
+            if dedup_key in self._pending_uploads:
+                return True
+            row = self._dedup.execute(
+                "SELECT 1 FROM uploaded_files WHERE key = ? AND uploaded_at > ?", (dedup_key, cutoff)
+            ).fetchone()
+        return row is not None
+
+    def _mark_uploaded(self, dedup_key: str):
+        """Remember a successful upload of a file until the session is completed."""
+        with self._dedup_lock:
+            self._pending_uploads[dedup_key] = time.time()
+
+    def _record_pending_uploads(self):
+        """Record the uploads of the completed session in the dedup database."""
+        if self._dedup is None:
+            return
+        with self._dedup_lock, self._dedup:
+            self._dedup.executemany(
+                "INSERT OR REPLACE INTO uploaded_files VALUES (?, ?)", list(self._pending_uploads.items())
+            )
+            self._pending_uploads.clear()
+
+    def _upload_path(self, file_path: str, entity_url: dict, file_name: str | None):
+        """Upload a local file, read from disk and sent to S3."""
+        file_name = file_name or self._extract_file_name(file_path)
+        with open(file_path, "rb", buffering=_LOCAL_FILE_BUFFER_SIZE) as f:
+            self._upload_to_s3(f, entity_url, file_name)
+
+    def _upload_file_like(self, file: BinaryIO, entity_url: dict, file_name: str | None):
+        """Upload a binary file-like object as is."""
+        if not file_name:
+            raise ValueError("file_name must be provided when uploading a file-like or StreamingBody object.")
+        self._upload_to_s3(file, entity_url, file_name)
+
+    def _upload_streaming_body(self, streaming_body: StreamingBody, entity_url: dict, file_name: str | None):
+        """Upload a StreamingBody, wrapped so it is streamed instead of read into memory."""
+        self._upload_file_like(self._wrap_streaming_body(streaming_body), entity_url, file_name)
+
+    def _upload_other(self, file, entity_url: dict, file_name: str | None):
+        """Upload inputs whose exact type has no entry in `_UPLOAD_HANDLERS`, e.g. subclasses or other file-like objects."""
+        if isinstance(file, str):  # Local file path
+            self._upload_path(file, entity_url, file_name)
+        elif isinstance(file, StreamingBody):
+            self._upload_streaming_body(file, entity_url, file_name)
+        elif hasattr(file, "read"):  # File-like
+            self._upload_file_like(file, entity_url, file_name)
+        else:
+            raise TypeError("file must be a file path (str), a binary file-like object, or a StreamingBody object.")
+
+    # Upload handler names by exact input type, so the common inputs skip the isinstance checks in `_upload_other`.
+    # Names rather than functions, so handlers overridden in subclasses are used.
+    _UPLOAD_HANDLERS = {
+        str: "_upload_path",
+        StreamingBody: "_upload_streaming_body",
+        io.BytesIO: "_upload_file_like",
+        io.BufferedReader: "_upload_file_like",
+    }
+
+    def upload_files(
+        self,
+        entity_name: str,
+        files: Iterable[str | tuple[BinaryIO | StreamingBody, str]],
+        max_workers: int = 8,
+    ):
+        """
+        Upload many files to the same entity concurrently on an open session.
+
+        Args:
+            entity_name (str): The name of the entity to associate with the files.
+            files (Iterable[str | tuple]): The files to upload. Each item is either a file path (str)
+                                           or a (file, file_name) pair for file-like or StreamingBody objects.
+            max_workers (int): Maximum number of parallel uploads.
+        """
+        # Warm the cache once so the worker threads don't race for the entity URL.
+        self._get_diip_upload_entity_url(self._clean_name_for_s3(entity_name))
+
+        def upload(item):
+            if isinstance(item, tuple):
+                file, file_name = item
+                self.upload_file(entity_name, file, file_name)
+            else:
+                self.upload_file(entity_name, item)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(upload, files))
+
+    def upload_bundle(
+        self,
+        entity_name: str,
+        files: Iterable[str | tuple[io.BytesIO, str]],
+        bundle_name: str,
+    ):
+        """
+        Pack many small files into a single uncompressed tar archive and upload it as one file.
+
+        Args:
+            entity_name (str): The name of the entity to associate with the bundle.
+            files (Iterable[str | tuple]): The files to bundle. Each item is either a file path (str)
+                                           or a (file, file_name) pair for seekable file objects (e.g., io.BytesIO).
+            bundle_name (str): File name of the archive on the destination (e.g., "reports.tar").
+        """
+        entity_url = self._get_diip_upload_entity_url(self._clean_name_for_s3(entity_name))
+
+        # S3 needs the Content-Length up front, so the archive is written to a temporary file before streaming it.
+        with tempfile.TemporaryFile() as bundle:
+            with tarfile.open(fileobj=bundle, mode="w") as tar:
+                for item in files:
+                    if isinstance(item, tuple):
+                        file, file_name = item
+                        position = file.tell()
+                        tar_info = tarfile.TarInfo(file_name)
+                        tar_info.size = file.seek(0, io.SEEK_END) - position
+                        file.seek(position)
+                        tar.addfile(tar_info, file)
+                    else:
+                        tar.add(item, arcname=self._extract_file_name(item))
+            bundle.seek(0)
+            self._upload_to_s3(bundle, entity_url, bundle_name)
 
     def _initialize_upload(self) -> str:
         """Initialize the upload session and return the dataPackageId. It is happening every time the context manager is entered."""
         response = self._api_call("/upload/init")
-        logger.info(f"Initialized upload session with dataPackageId: {response['dataPackageId']}")
+        logger.info("Initialized upload session with dataPackageId: %s", response["dataPackageId"])
         return response["dataPackageId"]
 
     def _complete_upload(self):
         """Complete the upload session. It is happening every time the context manager is exited."""
         self._api_call(f"/upload/{self.data_package_id}/complete")
-        logger.info(f"Upload session completed for dataPackageId: {self.data_package_id}")
+        logger.info("Upload session completed for dataPackageId: %s", self.data_package_id)
 
     def _get_diip_upload_entity_url(self, entity_name: str) -> dict:
         """Get a DIIP URL for uploading a file, using a cached URL if valid. This is done once per entity."""
-        if entity_name in self._entity_url_cache:
-            cached_url, expiration_time = self._entity_url_cache[entity_name]
-            if datetime.now() < expiration_time:
-                logger.info(f"Reusing cached DIIP uploading URL for entity: {entity_name}")
-                return cached_url
+        cache_key = f"{self.data_package_id}:{entity_name}"
+        with self._entity_url_lock:
+            cached = self._entity_url_cache.get(cache_key)
+        if cached is not None and time.monotonic() < cached[1]:
+            logger.info("Reusing cached DIIP uploading URL for entity: %s", entity_name)
+            return cached[0]
 
+        # The API call runs outside the lock, so slow or retried requests don't block cache hits in other threads.
         response = self._api_call(f"/upload/{self.data_package_id}/entity/{entity_name}")
         entity_url = response["presignedUrlData"]
-        self._entity_url_cache[entity_name] = (entity_url, datetime.now() + timedelta(minutes=55))
-        logger.info(f"Generated and cached entity URL for entity: {entity_name}")
+        with self._entity_url_lock:
+            self._prune_expired_entity_urls()
+            self._entity_url_cache[cache_key] = (entity_url, time.monotonic() + self._ENTITY_URL_TTL)
+        logger.info("Generated and cached entity URL for entity: %s", entity_name)
         return entity_url
 
+    def _prune_expired_entity_urls(self):
+        """
+        Drop expired entries from the entity URL cache. Must be called with the cache lock held.
+        An injected cache may be shared with other uploaders that don't hold this lock, so a snapshot is iterated.
+        """
+        now = time.monotonic()
+        expired = [key for key, (_, expiration_time) in list(self._entity_url_cache.items()) if expiration_time <= now]
+        for key in expired:
+            self._entity_url_cache.pop(key, None)
+
     def _upload_to_s3(self, file_obj: io.BytesIO, entity_url: dict, file_name: str):
-        """Upload a file to S3 using the provided entity URL."""
-        response = requests.post(
-            entity_url["url"],
-            data=entity_url["fields"],
-            files={"file": (file_name, file_obj)}
-        )
+        """
+        Upload a file to S3 using the provided entity URL.
+        Seekable files are rewound and sent again when S3 fails with a network error or a 5xx status.
+        """
+        seekable = getattr(file_obj, "seekable", None) is not None and file_obj.seekable()
+        start_position = file_obj.tell() if seekable else None
+        attempts = self._S3_UPLOAD_ATTEMPTS if seekable else 1
+        for attempt in range(1, attempts + 1):
+            if attempt > 1:
+                time.sleep(self._S3_UPLOAD_BACKOFF * 2 ** (attempt - 2))
+                file_obj.seek(start_position)
+            try:
+                response = self._post_to_s3(file_obj, entity_url, file_name)
+            except RequestException as e:
+                if attempt == attempts:
+                    raise
+                logger.warning("Upload of file %s failed on attempt %s, retrying: %s", file_name, attempt, e)
+                continue
+            if response.status_code < 500 or attempt == attempts:
+                break
+            logger.warning("Upload of file %s failed on attempt %s with status %s, retrying.", file_name, attempt, response.status_code)
+
         if response.status_code == 204:
-            logger.info(f"File {file_name} uploaded successfully.")
+            logger.info("File %s uploaded successfully.", file_name)
         else:
-            logger.error(f"Failed to upload file {file_name}. Status: {response.status_code}, Reason: {response.text}")
+            logger.error("Failed to upload file %s. Status: %s, Reason: %s", file_name, response.status_code, response.text)
             raise Exception(f"Failed to upload file {file_name}")
 
+    def _post_to_s3(self, file_obj: io.BytesIO, entity_url: dict, file_name: str) -> requests.Response:
+        """
+        Send a single multipart POST of the file to S3.
+        The multipart body is streamed from the file when requests-toolbelt is installed and the file length is known,
+        otherwise requests builds the whole body in memory.
+        """
+        sized_file = self._sized_for_streaming(file_obj)
+        if MultipartEncoder is not None and sized_file is not None:
+            encoder = MultipartEncoder(
+                fields={**entity_url["fields"], "file": (file_name, sized_file, "application/octet-stream")}
+            )
+            return self._session.post(
+                entity_url["url"],
+                data=encoder,
+                headers={"Content-Type": encoder.content_type},
+                timeout=self._TIMEOUT
+            )
+        return self._session.post(
+            entity_url["url"],
+            data=entity_url["fields"],
+            files={"file": (file_name, file_obj)},
+            timeout=self._TIMEOUT
+        )
+
     def _api_call(self, endpoint: str, method: str = "POST", payload: dict | None = None) -> dict:
         """Make an API call to the specified endpoint."""
         url = f"{self.base_url}{endpoint}"
-        headers = {"x-api-key": self.api_key}
-        response = requests.request(method, url, headers=headers, json=payload)
+        response = self._session.request(method, url, headers=self._headers, json=payload, timeout=self._TIMEOUT)
         response.raise_for_status()
         return response.json()
 
     @staticmethod
+    def _create_session(base_url: str) -> requests.Session:
+        """
+        Create a pooled HTTP session shared by all API and S3 calls, so TLS handshakes are reused.
+        DIIP API calls are retried on transient failures. S3 uploads only retry failed connects here, because
+        a streamed body cannot be replayed by urllib3; `_upload_to_s3` rewinds and retries them instead.
+        """
+        session = requests.Session()
+        api_retry = Retry(
+            total=5,
+            connect=3,
+            read=3,
+            backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "POST", "PUT"]),
+            # Hand the last response back, so raise_for_status() still raises HTTPError once retries run out.
+            raise_on_status=False,
+        )
+        upload_retry = Retry(total=3, connect=3, read=0, status=0, backoff_factor=0.3)
+        for prefix in ("http://", "https://"):
+            session.mount(prefix, HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=upload_retry))
+        # The longest matching prefix wins, so all API calls go through the retrying adapter.
+        session.mount(base_url, HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=api_retry))
+        return session
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
     def _clean_name_for_s3(entity_name: str) -> str:
-        """Sanitize the entity name by replacing spaces and dashes with underscores."""
-        return entity_name.replace(" ", "_").replace("-", "_")
+        """Sanitize the entity name by replacing spaces and dashes with underscores. Entity names repeat, so results are cached."""
+        return entity_name.translate(DIIPUploader._S3_TRANS)
 
     @staticmethod
     def _extract_file_name(file_path: str) -> str:
         """Extract the file name from a file path."""
-        return file_path.split("/")[-1]
+        return os.path.basename(file_path)
 
     @staticmethod
-    def _convert_streaming_body_to_bytesio(streaming_body: StreamingBody) -> io.BytesIO:
-        """Convert a StreamingBody object to a BytesIO object."""
-        file_content = io.BytesIO(streaming_body.read())
-        file_content.seek(0)
-        return file_content
\ No newline at end of file
+    def _sized_for_streaming(file_obj: "BinaryIO | StreamingBody | _SizedReader") -> "_SizedReader | None":
+        """
+        Wrap a file so the multipart encoder sends it from the current position with the right length.
+        The encoder would otherwise send in-memory buffers whole, via getvalue(). Returns None if the length is unknown.
+        """
+        if isinstance(file_obj, _SizedReader):
+            return file_obj
+        if isinstance(file_obj, StreamingBody) or getattr(file_obj, "seekable", None) is None or not file_obj.seekable():
+            return None
+        position = file_obj.tell()
+        length = file_obj.seek(0, io.SEEK_END) - position
+        file_obj.seek(position)
+        return _SizedReader(file_obj, length)
+
+    @staticmethod
+    def _wrap_streaming_body(streaming_body: StreamingBody) -> "_SizedReader | StreamingBody":
+        """
+        Wrap a StreamingBody so the unread rest of it can be streamed to S3.
+        Bodies of unknown length are passed through as is.
+        """
+        content_length = getattr(streaming_body, "_content_length", None)
+        if content_length is None:
+            return streaming_body
+        return _SizedReader(streaming_body, int(content_length) - streaming_body._amount_read)
+
+
+class _SizedReader:
+    """
+    A read-only file-like view of a StreamingBody or a file from its current position that reports the remaining length.
+    The length lets the multipart encoder send a Content-Length and pull the body in chunks instead of reading it at once.
+    """
+
+    def __init__(self, file_obj: StreamingBody | BinaryIO, length: int):
+        self._file_obj = file_obj
+        self._remaining = length
+
+    @property
+    def len(self) -> int:
+        """Number of bytes not read yet."""
+        return self._remaining
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to `size` bytes from the underlying object, or everything left if `size` is negative."""
+        chunk = self._file_obj.read(size if size >= 0 else None)
+        if not chunk and size != 0 and self._remaining > 0:
+            # The encoder keeps reading until the length is used up, so stop it rather than spin on EOF.
+            raise OSError(f"File ended {self._remaining} bytes before its expected length.")
+        self._remaining -= len(chunk)
+        return chunk
@@ -8,6 +8,10 @@ setup(
         'requests',
         'botocore',
     ],
+    extras_require={
+        'streaming': ['requests-toolbelt'],
+        'async': ['aiohttp'],
+    },
     author='Michal Pajak',
     description='A service for data ingestion API to DIIP',
     url='https://github.com/Go3-Automation/data_ingestion_service',  
@@ -0,0 +1,154 @@
+import unittest
+from unittest.mock import patch, MagicMock, AsyncMock
+from data_ingestion_service.async_upload import AsyncDIIPUploader, aiohttp, upload_many
+import io
+
+
+def mock_response(status=200, json=None, text=''):
+    """Build a mock aiohttp response usable as `async with session.post(...) as response`."""
+    response = MagicMock(status=status)
+    response.json = AsyncMock(return_value=json)
+    response.text = AsyncMock(return_value=text)
+    context = MagicMock()
+    context.__aenter__ = AsyncMock(return_value=response)
+    context.__aexit__ = AsyncMock(return_value=False)
+    return context
+
+
+def api_response(method, url, headers=None, json=None):
+    """Respond to DIIP API calls like the real service."""
+    if url.endswith('/upload/init'):
+        return mock_response(json={'dataPackageId': '12345'})
+    if '/entity/' in url:
+        return mock_response(json={'presignedUrlData': {'url': 'https://s3.amazonaws.com', 'fields': {'key': 'value'}}})
+    return mock_response(json={})
+
+
+@unittest.skipIf(aiohttp is None, "requires aiohttp")
+class TestAsyncDIIPUploader(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        patcher = patch('data_ingestion_service.async_upload.aiohttp.ClientSession')
+        self.mock_client_session = patcher.start()
+        self.mock_session = self.mock_client_session.return_value
+        self.addCleanup(patcher.stop)
+        self.mock_session.close = AsyncMock()
+        self.mock_session.request.side_effect = api_response
+        self.mock_session.post.return_value = mock_response(status=204)
+
+    async def test_context_manager(self):
+        """Test that the context manager initializes and completes the upload session."""
+        async with AsyncDIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
+            self.assertEqual(uploader.data_package_id, '12345')
+
+        self.mock_session.request.assert_any_call(
+            'POST', 'https://example.com/upload/init', headers={'x-api-key': 'test-api-key'}, json=None
+        )
+        self.mock_session.request.assert_any_call(
+            'POST', 'https://example.com/upload/12345/complete', headers={'x-api-key': 'test-api-key'}, json=None
+        )
+        self.mock_session.close.assert_awaited_once()
+
+    async def test_session_timeouts(self):
+        """Test that uploads have no total time limit but bounded connect and read waits."""
+        async with AsyncDIIPUploader(base_url='https://example.com', api_key='test-api-key'):
+            pass
+
+        timeout = self.mock_client_session.call_args[1]['timeout']
+        self.assertIsNone(timeout.total)
+        self.assertEqual((timeout.sock_connect, timeout.sock_read), (5, 60))
+
+    async def test_upload_many(self):
+        """Test that files for several entities are uploaded with one entity URL request per entity."""
+        async with AsyncDIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
+            await uploader.upload_many({
+                'test entity': ['test_file.txt', (io.BytesIO(b'test content'), 'other_file.txt')],
+                'other-entity': ['test_file.txt'],
+            })
+
+        entity_urls = [call[0][1] for call in self.mock_session.request.call_args_list if '/entity/' in call[0][1]]
+        self.assertEqual(sorted(entity_urls), [
+            'https://example.com/upload/12345/entity/other_entity',
+            'https://example.com/upload/12345/entity/test_entity',
+        ])
+        self.assertEqual(self.mock_session.post.call_count, 3)
+
+    async def test_reentered_uploader_uses_new_entity_urls(self):
+        """Test that entering the same uploader again fetches entity URLs for the new data package."""
+        package_ids = iter(['pkg1', 'pkg2'])
+
+        def api_response_per_package(method, url, headers=None, json=None):
+            if url.endswith('/upload/init'):
+                return mock_response(json={'dataPackageId': next(package_ids)})
+            if '/entity/' in url:
+                return mock_response(json={'presignedUrlData': {'url': url, 'fields': {}}})
+            return mock_response(json={})
+
+        self.mock_session.request.side_effect = api_response_per_package
+        uploader = AsyncDIIPUploader(base_url='https://example.com', api_key='test-api-key')
+
+        async with uploader:
+            await uploader.upload_file(entity_name='test_entity', file='test_file.txt')
+        async with uploader:
+            await uploader.upload_file(entity_name='test_entity', file='test_file.txt')
+
+        self.assertEqual([call[0][0] for call in self.mock_session.post.call_args_list], [
+            'https://example.com/upload/pkg1/entity/test_entity',
+            'https://example.com/upload/pkg2/entity/test_entity',
+        ])
+
+    async def test_api_key_not_sent_to_s3(self):
+        """Test that the API key is not a session default header, so S3 uploads don't carry it."""
+        async with AsyncDIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
+            await uploader.upload_file(entity_name='test_entity', file='test_file.txt')
+
+        self.assertNotIn('headers', self.mock_client_session.call_args[1])
+        self.assertNotIn('headers', self.mock_session.post.call_args[1])
+
+    @patch.object(AsyncDIIPUploader, '_api_call', new_callable=AsyncMock)
+    async def test_session_closed_when_init_fails(self, mock_api_call):
+        """Test that the HTTP session is closed if the upload session cannot be initialized."""
+        mock_api_call.side_effect = RuntimeError('500 Internal Server Error')
+
+        with self.assertRaises(RuntimeError):
+            async with AsyncDIIPUploader(base_url='https://example.com', api_key='test-api-key'):
+                pass
+
+        self.mock_session.close.assert_awaited_once()
+
+    async def test_upload_file_failure(self):
+        """Test handling of a failed upload."""
+        self.mock_session.post.return_value = mock_response(status=400, text='Bad Request')
+
+        async with AsyncDIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
+            with self.assertRaises(Exception) as context:
+                await uploader.upload_file(entity_name='test_entity', file='test_file.txt')
+
+        self.assertIn('Failed to upload file test_file.txt', str(context.exception))
+
+    async def test_upload_file_requires_file_name(self):
+        """Test that in-memory uploads need an explicit file name."""
+        async with AsyncDIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
+            with self.assertRaises(ValueError):
+                await uploader.upload_file(entity_name='test_entity', file=io.BytesIO(b'test content'))
+
+
+@unittest.skipIf(aiohttp is None, "requires aiohttp")
+class TestUploadMany(unittest.TestCase):
+
+    @patch.object(AsyncDIIPUploader, 'upload_many', new_callable=AsyncMock)
+    @patch.object(AsyncDIIPUploader, '_api_call', new_callable=AsyncMock)
+    @patch('data_ingestion_service.async_upload.aiohttp.ClientSession')
+    def test_upload_many_sync(self, mock_client_session, mock_api_call, mock_upload_many):
+        """Test that the synchronous wrapper runs a full upload session."""
+        mock_client_session.return_value.close = AsyncMock()
+        mock_api_call.return_value = {'dataPackageId': '12345'}
+
+        upload_many('https://example.com', 'test-api-key', {'test_entity': ['test_file.txt']})
+
+        mock_upload_many.assert_awaited_once_with({'test_entity': ['test_file.txt']})
+        mock_api_call.assert_any_await('/upload/12345/complete')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,22 @@
-from datetime import datetime
 import unittest
 from unittest.mock import patch, MagicMock
-from data_ingestion_service.upload import DIIPUploader
+from data_ingestion_service.upload import DIIPUploader, _SizedReader
 from botocore.response import StreamingBody
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from http.server import BaseHTTPRequestHandler, HTTPServer
 import io
+import os
+import tarfile
+import tempfile
+import threading
+import time
+
+try:
+    from requests_toolbelt import MultipartEncoder
+except ImportError:  # Optional "streaming" extra.
+    MultipartEncoder = None
 
 
 class TestDIIPUploader(unittest.TestCase):
@@ -11,125 +24,578 @@ class TestDIIPUploader(unittest.TestCase):
     @patch('data_ingestion_service.upload.requests')
     def test_initialize_upload(self, mock_requests):
         """Test that the upload session is initialized correctly."""
-        mock_requests.request.return_value.status_code = 200
-        mock_requests.request.return_value.json.return_value = {'dataPackageId': '12345'}
+        mock_session = mock_requests.Session.return_value
+        mock_session.request.return_value.status_code = 200
+        mock_session.request.return_value.json.return_value = {'dataPackageId': '12345'}
 
         uploader = DIIPUploader(base_url='https://example.com', api_key='test-api-key')
         data_package_id = uploader._initialize_upload()
 
         self.assertEqual(data_package_id, '12345')
-        mock_requests.request.assert_called_once_with(
+        mock_session.request.assert_called_once_with(
             'POST',
             'https://example.com/upload/init',
             headers={'x-api-key': 'test-api-key'},
-            json=None
+            json=None,
+            timeout=(5, 60)
         )
 
     @patch('data_ingestion_service.upload.requests')
     def test_complete_upload(self, mock_requests):
         """Test that the upload session is completed correctly."""
-        mock_requests.request.return_value.status_code = 200
+        mock_session = mock_requests.Session.return_value
+        mock_session.request.return_value.status_code = 200
 
         uploader = DIIPUploader(base_url='https://example.com', api_key='test-api-key')
         uploader.data_package_id = '12345'
         uploader._complete_upload()
 
-        mock_requests.request.assert_called_once_with(
+        mock_session.request.assert_called_once_with(
             'POST',
             'https://example.com/upload/12345/complete',
             headers={'x-api-key': 'test-api-key'},
-            json=None
+            json=None,
+            timeout=(5, 60)
         )
 
+    @unittest.skipIf(MultipartEncoder is None, "requires requests-toolbelt")
     @patch('data_ingestion_service.upload.requests')
     def test_upload_file_local(self, mock_requests):
         """Test uploading a local file."""
-        mock_requests.post.return_value.status_code = 204
+        mock_session = mock_requests.Session.return_value
+        mock_session.post.return_value.status_code = 204
+
+        with DIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
+            uploader._entity_url_cache[f'{uploader.data_package_id}:test_entity'] = (
+                {'url': 'https://s3.amazonaws.com', 'fields': {}},
+                time.monotonic() + 300
+            )
+            uploader.upload_file(entity_name='test_entity', file='test_file.txt')
+
+        mock_session.post.assert_called_once()
+        self.assertEqual(mock_session.post.call_args[1]['data'].fields['file'][0], 'test_file.txt')
+
+    @unittest.skipIf(MultipartEncoder is None, "requires requests-toolbelt")
+    @patch('data_ingestion_service.upload.requests')
+    def test_upload_file_in_memory_from_current_position(self, mock_requests):
+        """Test that an in-memory file is uploaded from its current position, not from the start of the buffer."""
+        mock_session = mock_requests.Session.return_value
+        mock_session.post.return_value.status_code = 204
+        mock_file = io.BytesIO(b'header line\ntest content')
+        mock_file.readline()
+
+        with DIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
+            uploader._entity_url_cache[f'{uploader.data_package_id}:test_entity'] = (
+                {'url': 'https://s3.amazonaws.com', 'fields': {}},
+                time.monotonic() + 300
+            )
+            uploader.upload_file(entity_name='test_entity', file=mock_file, file_name='test_file.txt')
+
+        encoder = mock_session.post.call_args[1]['data']
+        body = encoder.to_string()
+        self.assertIn(b'\r\n\r\ntest content\r\n', body)
+        self.assertNotIn(b'header line', body)
+        self.assertEqual(encoder.len, len(body))
+
+    @unittest.skipIf(MultipartEncoder is None, "requires requests-toolbelt")
+    @patch('data_ingestion_service.upload.requests')
+    def test_upload_file_partly_read_streaming_body(self, mock_requests):
+        """Test that a partly read StreamingBody is streamed from where reading stopped."""
+        mock_session = mock_requests.Session.return_value
+        mock_session.post.return_value.status_code = 204
+        streaming_body = StreamingBody(io.BytesIO(b'header\ntest content'), 19)
+        streaming_body.read(7)
 
         with DIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
-            uploader._entity_url_cache['test_entity'] = (
+            uploader._entity_url_cache[f'{uploader.data_package_id}:test_entity'] = (
                 {'url': 'https://s3.amazonaws.com', 'fields': {}},
-                datetime.now()
+                time.monotonic() + 300
+            )
+            uploader.upload_file(entity_name='test_entity', file=streaming_body, file_name='test_file.txt')
+
+        encoder = mock_session.post.call_args[1]['data']
+        body = encoder.to_string()
+        self.assertIn(b'\r\n\r\ntest content\r\n', body)
+        self.assertNotIn(b'header', body)
+        self.assertEqual(encoder.len, len(body))
+
+    def test_sized_reader_raises_on_early_end_of_file(self):
+        """Test that a source shorter than its announced length raises instead of looping forever."""
+        reader = _SizedReader(io.BytesIO(b'short'), 10)
+
+        self.assertEqual(reader.read(5), b'short')
+        with self.assertRaises(OSError):
+            reader.read(5)
+
+    @patch('data_ingestion_service.upload.MultipartEncoder', None)
+    @patch('data_ingestion_service.upload.requests')
+    def test_upload_file_without_streaming_extra(self, mock_requests):
+        """Test that uploads fall back to a plain multipart POST when requests-toolbelt is not installed."""
+        mock_session = mock_requests.Session.return_value
+        mock_session.post.return_value.status_code = 204
+
+        with DIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
+            uploader._entity_url_cache[f'{uploader.data_package_id}:test_entity'] = (
+                {'url': 'https://s3.amazonaws.com', 'fields': {}},
+                time.monotonic() + 300
             )
             uploader.upload_file(entity_name='test_entity', file='test_file.txt')
 
-        mock_requests.post.assert_called_once()
-        self.assertEqual(mock_requests.post.call_args[1]['files']['file'][0], 'test_file.txt')
+        mock_session.post.assert_called_once()
+        self.assertEqual(mock_session.post.call_args[1]['files']['file'][0], 'test_file.txt')
 
+    @unittest.skipIf(MultipartEncoder is None, "requires requests-toolbelt")
     @patch('data_ingestion_service.upload.requests')
     def test_upload_file_in_memory(self, mock_requests):
         """Test uploading an in-memory file."""
-        mock_requests.post.return_value.status_code = 204
+        mock_session = mock_requests.Session.return_value
+        mock_session.post.return_value.status_code = 204
         mock_file = io.BytesIO(b'test content')
 
         with DIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
-            uploader._entity_url_cache['test_entity'] = (
+            uploader._entity_url_cache[f'{uploader.data_package_id}:test_entity'] = (
                 {'url': 'https://s3.amazonaws.com', 'fields': {}},
-                datetime.now()
+                time.monotonic() + 300
             )
             #assert typep e(mock_file) == io.BytesIO
             assert isinstance(mock_file, io.BytesIO)
             uploader.upload_file(entity_name='test_entity', file=mock_file, file_name='test_file.txt')
 
-        mock_requests.post.assert_called_once()
-        self.assertEqual(mock_requests.post.call_args[1]['files']['file'][0], 'test_file.txt')
+        mock_session.post.assert_called_once()
+        self.assertEqual(mock_session.post.call_args[1]['data'].fields['file'][0], 'test_file.txt')
+
+    @unittest.skipIf(MultipartEncoder is None, "requires requests-toolbelt")
+    @patch('data_ingestion_service.upload.requests')
+    def test_upload_file_open_file(self, mock_requests):
+        """Test uploading an already open file object."""
+        mock_session = mock_requests.Session.return_value
+        mock_session.post.return_value.status_code = 204
+
+        with DIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
+            uploader._entity_url_cache[f'{uploader.data_package_id}:test_entity'] = (
+                {'url': 'https://s3.amazonaws.com', 'fields': {}},
+                time.monotonic() + 300
+            )
+            with open('test_file.txt', 'rb') as f:
+                uploader.upload_file(entity_name='test_entity', file=f, file_name='renamed_file.txt')
+
+        mock_session.post.assert_called_once()
+        self.assertEqual(mock_session.post.call_args[1]['data'].fields['file'][0], 'renamed_file.txt')
+
+    @patch('data_ingestion_service.upload.requests')
+    def test_upload_file_dispatch_by_exact_type(self, mock_requests):
+        """Test that common input types go straight to their handler, including handlers overridden in subclasses."""
+        class RecordingUploader(DIIPUploader):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.handled = []
+
+            def _upload_path(self, file_path, entity_url, file_name):
+                self.handled.append(('path', file_path))
+
+            def _upload_file_like(self, file, entity_url, file_name):
+                self.handled.append(('file_like', file_name))
+
+        with RecordingUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
+            with patch.object(uploader, '_upload_other') as mock_upload_other:
+                uploader.upload_file(entity_name='test_entity', file='test_file.txt')
+                uploader.upload_file(entity_name='test_entity', file=io.BytesIO(b'test content'), file_name='a.txt')
+                with open('test_file.txt', 'rb') as f:
+                    uploader.upload_file(entity_name='test_entity', file=f, file_name='b.txt')
+
+        mock_upload_other.assert_not_called()
+        self.assertEqual(uploader.handled, [('path', 'test_file.txt'), ('file_like', 'a.txt'), ('file_like', 'b.txt')])
+
+    @unittest.skipIf(MultipartEncoder is None, "requires requests-toolbelt")
+    @patch('data_ingestion_service.upload.requests')
+    def test_upload_file_fallback_dispatch(self, mock_requests):
+        """Test that subclasses and other file-like objects are dispatched through the isinstance fallback."""
+        mock_session = mock_requests.Session.return_value
+        mock_session.post.return_value.status_code = 204
+
+        class NamedBytesIO(io.BytesIO):
+            pass
+
+        with DIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
+            uploader._entity_url_cache[f'{uploader.data_package_id}:test_entity'] = (
+                {'url': 'https://s3.amazonaws.com', 'fields': {}},
+                time.monotonic() + 300
+            )
+            with patch.object(uploader, '_upload_other', wraps=uploader._upload_other) as mock_upload_other:
+                uploader.upload_file(entity_name='test_entity', file=NamedBytesIO(b'test content'), file_name='a.txt')
+                with tempfile.SpooledTemporaryFile() as spooled:
+                    spooled.write(b'test content')
+                    spooled.seek(0)
+                    uploader.upload_file(entity_name='test_entity', file=spooled, file_name='b.txt')
+                    uploaded = [call[1]['data'].fields['file'][0] for call in mock_session.post.call_args_list]
+                    bodies = [call[1]['data'].to_string() for call in mock_session.post.call_args_list]
+
+        self.assertEqual(mock_upload_other.call_count, 2)
+        self.assertEqual(uploaded, ['a.txt', 'b.txt'])
+        self.assertTrue(all(b'test content' in body for body in bodies))
+
+    @patch('data_ingestion_service.upload.requests')
+    def test_upload_file_invalid_type(self, mock_requests):
+        """Test that objects which are neither paths nor file-like are rejected."""
+        with DIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
+            with self.assertRaises(TypeError):
+                uploader.upload_file(entity_name='test_entity', file=b'test content', file_name='test_file.txt')
 
     @patch('data_ingestion_service.upload.requests')
     def test_upload_file_streaming_body(self, mock_requests):
         """Test uploading a file from a StreamingBody."""
-        mock_requests.post.return_value.status_code = 204
+        mock_session = mock_requests.Session.return_value
+        mock_session.post.return_value.status_code = 204
         streaming_body_mock = MagicMock(spec=StreamingBody)
         streaming_body_mock.read.return_value = b'test content'
 
         with DIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
-            uploader._entity_url_cache['test_entity'] = (
+            uploader._entity_url_cache[f'{uploader.data_package_id}:test_entity'] = (
                 {'url': 'https://s3.amazonaws.com', 'fields': {}},
-                datetime.now()
+                time.monotonic() + 300
             )
             uploader.upload_file(entity_name='test_entity', file=streaming_body_mock, file_name='test_file.txt')
 
-        mock_requests.post.assert_called_once()
-        self.assertEqual(mock_requests.post.call_args[1]['files']['file'][0], 'test_file.txt')
+        mock_session.post.assert_called_once()
+        self.assertEqual(mock_session.post.call_args[1]['files']['file'][0], 'test_file.txt')
+
+    @unittest.skipIf(MultipartEncoder is None, "requires requests-toolbelt")
+    @patch('data_ingestion_service.upload.requests')
+    def test_upload_file_streaming_body_is_streamed(self, mock_requests):
+        """Test that a StreamingBody of known length is streamed, not read into memory."""
+        mock_session = mock_requests.Session.return_value
+        mock_session.post.return_value.status_code = 204
+        streaming_body = StreamingBody(io.BytesIO(b'test content'), 12)
+
+        with DIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
+            uploader._entity_url_cache[f'{uploader.data_package_id}:test_entity'] = (
+                {'url': 'https://s3.amazonaws.com', 'fields': {'key': 'value'}},
+                time.monotonic() + 300
+            )
+            uploader.upload_file(entity_name='test_entity', file=streaming_body, file_name='test_file.txt')
+
+        encoder = mock_session.post.call_args[1]['data']
+        self.assertIsInstance(encoder, MultipartEncoder)
+        self.assertEqual(list(encoder.fields), ['key', 'file'])
+        self.assertEqual(encoder.fields['file'][0], 'test_file.txt')
+        self.assertEqual(streaming_body._amount_read, 0)
+        self.assertIn(b'test content', encoder.to_string())
+
+    @unittest.skipIf(MultipartEncoder is None, "requires requests-toolbelt")
+    @patch('data_ingestion_service.upload.requests')
+    def test_upload_files(self, mock_requests):
+        """Test uploading several files concurrently with a single entity URL request."""
+        mock_session = mock_requests.Session.return_value
+        mock_session.post.return_value.status_code = 204
+        mock_session.request.return_value.json.return_value = {
+            'dataPackageId': '12345',
+            'presignedUrlData': {'url': 'https://s3.amazonaws.com', 'fields': {}},
+        }
+
+        with DIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
+            uploader.upload_files(
+                entity_name='test_entity',
+                files=['test_file.txt', (io.BytesIO(b'test content'), 'other_file.txt')],
+                max_workers=2,
+            )
+
+        uploaded = sorted(call[1]['data'].fields['file'][0] for call in mock_session.post.call_args_list)
+        self.assertEqual(uploaded, ['other_file.txt', 'test_file.txt'])
+        entity_calls = [call for call in mock_session.request.call_args_list if '/entity/' in call[0][1]]
+        self.assertEqual(len(entity_calls), 1)
+
+    @unittest.skipIf(MultipartEncoder is None, "requires requests-toolbelt")
+    @patch('data_ingestion_service.upload.requests')
+    def test_upload_bundle(self, mock_requests):
+        """Test that several files are uploaded as a single tar archive."""
+        mock_session = mock_requests.Session.return_value
+        bundles = {}
+
+        def post(*args, **kwargs):
+            file_name, file_obj, _ = kwargs['data'].fields['file']
+            with tarfile.open(fileobj=file_obj, mode='r|') as tar:
+                bundles[file_name] = {member.name: tar.extractfile(member).read() for member in tar}
+            return MagicMock(status_code=204)
+
+        mock_session.post.side_effect = post
+
+        with DIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
+            uploader._entity_url_cache[f'{uploader.data_package_id}:test_entity'] = (
+                {'url': 'https://s3.amazonaws.com', 'fields': {}},
+                time.monotonic() + 300
+            )
+            uploader.upload_bundle(
+                entity_name='test_entity',
+                files=['test_file.txt', (io.BytesIO(b'test content'), 'other_file.txt')],
+                bundle_name='bundle.tar',
+            )
+
+        mock_session.post.assert_called_once()
+        self.assertEqual(list(bundles), ['bundle.tar'])
+        self.assertEqual(sorted(bundles['bundle.tar']), ['other_file.txt', 'test_file.txt'])
+        self.assertEqual(bundles['bundle.tar']['other_file.txt'], b'test content')
+
+    @patch('data_ingestion_service.upload.requests')
+    def test_upload_file_dedup(self, mock_requests):
+        """Test that files recorded as uploaded are skipped in later sessions unless forced."""
+        mock_session = mock_requests.Session.return_value
+        mock_session.post.return_value.status_code = 204
+        mock_session.request.return_value.json.return_value = {
+            'dataPackageId': '12345',
+            'presignedUrlData': {'url': 'https://s3.amazonaws.com', 'fields': {}},
+        }
+        dedup_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(dedup_dir.cleanup)
+        dedup_path = os.path.join(dedup_dir.name, 'dedup.sqlite')
+
+        with DIIPUploader(base_url='https://example.com', api_key='test-api-key', dedup_path=dedup_path) as uploader:
+            uploader.upload_file(entity_name='test_entity', file='test_file.txt')
+            uploader.upload_file(entity_name='test_entity', file=io.BytesIO(b'test content'), file_name='other_file.txt')
+        self.assertEqual(mock_session.post.call_count, 2)
+
+        with DIIPUploader(base_url='https://example.com', api_key='test-api-key', dedup_path=dedup_path) as uploader:
+            uploader.upload_file(entity_name='test_entity', file='test_file.txt')
+            uploader.upload_file(entity_name='test_entity', file=io.BytesIO(b'test content'), file_name='other_file.txt')
+            uploader.upload_file(entity_name='test_entity', file=io.BytesIO(b'new content!'), file_name='other_file.txt')
+            uploader.upload_file(entity_name='other_entity', file='test_file.txt')
+            uploader.upload_file(entity_name='test_entity', file='test_file.txt', force=True)
+        self.assertEqual(mock_session.post.call_count, 5)
+
+        with DIIPUploader(base_url='https://example.com', api_key='test-api-key', dedup_path=dedup_path,
+                          dedup_ttl=0) as uploader:
+            uploader.upload_file(entity_name='test_entity', file='test_file.txt')
+        self.assertEqual(mock_session.post.call_count, 6)
+
+    def test_entity_url_fetch_does_not_block_cache_hits(self):
+        """Test that a slow entity URL request does not block cached lookups in other threads."""
+        uploader = DIIPUploader(base_url='https://example.com', api_key='test-api-key')
+        uploader.data_package_id = '12345'
+        uploader._entity_url_cache['12345:cached_entity'] = ({'url': 'cached'}, time.monotonic() + 300)
+        fetch_started, release_fetch = threading.Event(), threading.Event()
+
+        def slow_api_call(endpoint):
+            fetch_started.set()
+            release_fetch.wait(5)
+            return {'presignedUrlData': {'url': 'fetched'}}
+
+        with patch.object(uploader, '_api_call', side_effect=slow_api_call):
+            fetch = threading.Thread(target=uploader._get_diip_upload_entity_url, args=('new_entity',))
+            fetch.start()
+            fetch_started.wait(5)
+            self.assertEqual(uploader._get_diip_upload_entity_url('cached_entity'), {'url': 'cached'})
+            release_fetch.set()
+            fetch.join(5)
+
+        self.assertEqual(uploader._entity_url_cache['12345:new_entity'][0], {'url': 'fetched'})
+
+    @patch('data_ingestion_service.upload.requests')
+    def test_upload_file_dedup_reentered_uploader(self, mock_requests):
+        """Test that the same uploader with dedup can be entered again after a session."""
+        mock_session = mock_requests.Session.return_value
+        mock_session.post.return_value.status_code = 204
+        mock_session.request.return_value.json.return_value = {
+            'dataPackageId': '12345',
+            'presignedUrlData': {'url': 'https://s3.amazonaws.com', 'fields': {}},
+        }
+        dedup_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(dedup_dir.cleanup)
+        uploader = DIIPUploader(base_url='https://example.com', api_key='test-api-key',
+                                dedup_path=os.path.join(dedup_dir.name, 'dedup.sqlite'))
+
+        with uploader:
+            uploader.upload_file(entity_name='test_entity', file='test_file.txt')
+            uploader.upload_file(entity_name='test_entity', file='test_file.txt')
+        with uploader:
+            uploader.upload_file(entity_name='test_entity', file='test_file.txt')
+
+        self.assertEqual(mock_session.post.call_count, 1)
+
+    @patch('data_ingestion_service.upload.requests')
+    def test_upload_file_dedup_not_recorded_when_completion_fails(self, mock_requests):
+        """Test that uploads are not recorded as done when the upload session fails to complete."""
+        mock_session = mock_requests.Session.return_value
+        mock_session.post.return_value.status_code = 204
+        responses = {
+            '/upload/init': {'dataPackageId': '12345'},
+            '/upload/12345/entity/test_entity': {'presignedUrlData': {'url': 'https://s3.amazonaws.com', 'fields': {}}},
+        }
+
+        def request(method, url, **kwargs):
+            if url.endswith('/complete') and mock_session.post.call_count == 1:
+                raise requests.HTTPError('503 Server Error')
+            return MagicMock(**{'json.return_value': responses.get(url.removeprefix('https://example.com'), {})})
+
+        mock_session.request.side_effect = request
+        dedup_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(dedup_dir.cleanup)
+        dedup_path = os.path.join(dedup_dir.name, 'dedup.sqlite')
+
+        with self.assertRaises(requests.HTTPError):
+            with DIIPUploader(base_url='https://example.com', api_key='test-api-key', dedup_path=dedup_path) as uploader:
+                uploader.upload_file(entity_name='test_entity', file='test_file.txt')
+        with DIIPUploader(base_url='https://example.com', api_key='test-api-key', dedup_path=dedup_path) as uploader:
+            uploader.upload_file(entity_name='test_entity', file='test_file.txt')
+
+        self.assertEqual(mock_session.post.call_count, 2)
+
+    def test_clean_name_for_s3(self):
+        """Test that spaces and dashes in entity names are replaced with underscores."""
+        self.assertEqual(DIIPUploader._clean_name_for_s3('daily sales-report'), 'daily_sales_report')
+        self.assertEqual(DIIPUploader._clean_name_for_s3('test_entity'), 'test_entity')
+
+    @patch('data_ingestion_service.upload.requests')
+    def test_entity_url_cache(self, mock_requests):
+        """Test that entity URLs are cached per data package in the injected store and expired entries are pruned."""
+        mock_session = mock_requests.Session.return_value
+        mock_session.request.return_value.json.return_value = {'presignedUrlData': {'url': 'https://s3.amazonaws.com'}}
+        cache = {'12345:stale_entity': ({}, time.monotonic() - 60)}
+
+        uploader = DIIPUploader(base_url='https://example.com', api_key='test-api-key', cache=cache)
+        uploader.data_package_id = '12345'
+        uploader._get_diip_upload_entity_url('test_entity')
+        uploader._get_diip_upload_entity_url('test_entity')
+
+        mock_session.request.assert_called_once_with(
+            'POST',
+            'https://example.com/upload/12345/entity/test_entity',
+            headers={'x-api-key': 'test-api-key'},
+            json=None,
+            timeout=(5, 60)
+        )
+        self.assertEqual(list(cache), ['12345:test_entity'])
+        self.assertEqual(DIIPUploader(base_url='https://example.com', api_key='test-api-key')._entity_url_cache, {})
 
     @patch('data_ingestion_service.upload.requests')
     def test_upload_file_failure(self, mock_requests):
         """Test handling of a failed upload."""
-        mock_requests.post.return_value.status_code = 400
-        mock_requests.post.return_value.text = 'Bad Request'
+        mock_session = mock_requests.Session.return_value
+        mock_session.post.return_value.status_code = 400
+        mock_session.post.return_value.text = 'Bad Request'
 
         with DIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
-            uploader._entity_url_cache['test_entity'] = (
+            uploader._entity_url_cache[f'{uploader.data_package_id}:test_entity'] = (
                 {'url': 'https://s3.amazonaws.com', 'fields': {}},
-                datetime.now()
+                time.monotonic() + 300
             )
             with self.assertRaises(Exception) as context:
                 uploader.upload_file(entity_name='test_entity', file='test_file.txt')
 
         self.assertIn('Failed to upload file test_file.txt', str(context.exception))
 
+    @unittest.skipIf(MultipartEncoder is None, "requires requests-toolbelt")
+    @patch('data_ingestion_service.upload.time.sleep')
+    @patch('data_ingestion_service.upload.requests')
+    def test_upload_file_retried_on_server_error(self, mock_requests, mock_sleep):
+        """Test that a seekable file is rewound to its start position and uploaded again after a 5xx response from S3."""
+        mock_session = mock_requests.Session.return_value
+        mock_file = io.BytesIO(b'header line\ntest content')
+        mock_file.readline()
+        bodies = []
+
+        def post(*args, **kwargs):
+            bodies.append(kwargs['data'].to_string())
+            return MagicMock(status_code=503 if len(bodies) == 1 else 204)
+
+        mock_session.post.side_effect = post
+
+        with DIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
+            uploader._entity_url_cache[f'{uploader.data_package_id}:test_entity'] = (
+                {'url': 'https://s3.amazonaws.com', 'fields': {}},
+                time.monotonic() + 300
+            )
+            uploader.upload_file(entity_name='test_entity', file=mock_file, file_name='test_file.txt')
+
+        self.assertEqual(len(bodies), 2)
+        for body in bodies:
+            self.assertTrue(body.split(b'\r\n\r\n')[1].startswith(b'test content\r\n'))
+        mock_sleep.assert_called_once()
+
     @patch('data_ingestion_service.upload.requests')
     def test_context_manager(self, mock_requests):
         """Test that the context manager initializes and completes the upload session."""
-        mock_requests.request.return_value.status_code = 200
-        mock_requests.request.return_value.json.return_value = {'dataPackageId': '12345'}
+        mock_session = mock_requests.Session.return_value
+        mock_session.request.return_value.status_code = 200
+        mock_session.request.return_value.json.return_value = {'dataPackageId': '12345'}
 
         with DIIPUploader(base_url='https://example.com', api_key='test-api-key') as uploader:
             self.assertEqual(uploader.data_package_id, '12345')
 
-        mock_requests.request.assert_any_call(
+        mock_session.request.assert_any_call(
             'POST',
             'https://example.com/upload/init',
             headers={'x-api-key': 'test-api-key'},
-            json=None
+            json=None,
+            timeout=(5, 60)
         )
-        mock_requests.request.assert_any_call(
+        mock_session.request.assert_any_call(
             'POST',
             'https://example.com/upload/12345/complete',
             headers={'x-api-key': 'test-api-key'},
-            json=None
+            json=None,
+            timeout=(5, 60)
         )
 
 
+    @patch('data_ingestion_service.upload.requests')
+    def test_session_setup(self, mock_requests):
+        """Test that a single pooled session is shared by all calls and closed on exit."""
+        mock_session = mock_requests.Session.return_value
+        mock_session.request.return_value.json.return_value = {'dataPackageId': '12345'}
+
+        with DIIPUploader(base_url='https://example.com', api_key='test-api-key'):
+            pass
+
+        mock_requests.Session.assert_called_once_with()
+        adapters = {call[0][0]: call[0][1] for call in mock_session.mount.call_args_list}
+        self.assertEqual(sorted(adapters), ['http://', 'https://', 'https://example.com'])
+        self.assertIn('POST', adapters['https://example.com'].max_retries.allowed_methods)
+        self.assertEqual(adapters['https://'].max_retries.status, 0)
+        mock_session.close.assert_called_once()
+
+    @patch.object(HTTPAdapter, 'send')
+    def test_api_key_not_sent_to_s3(self, mock_send):
+        """Test that the API key goes to the DIIP API only and never to the S3 presigned URL."""
+        mock_send.return_value.status_code = 204
+        mock_send.return_value.is_redirect = False
+        mock_send.return_value.json.return_value = {'dataPackageId': '12345'}
+
+        uploader = DIIPUploader(base_url='https://example.com', api_key='test-api-key')
+        uploader._initialize_upload()
+        uploader._upload_to_s3(io.BytesIO(b'test content'), {'url': 'https://s3.amazonaws.com', 'fields': {}}, 'test_file.txt')
+
+        api_request, s3_request = (call[0][0] for call in mock_send.call_args_list)
+        self.assertEqual(api_request.headers['x-api-key'], 'test-api-key')
+        self.assertEqual(s3_request.url, 'https://s3.amazonaws.com/')
+        self.assertNotIn('x-api-key', s3_request.headers)
+
+    @patch.object(Retry, 'sleep')
+    def test_api_call_raises_http_error_after_retries(self, mock_sleep):
+        """Test that a persistent 5xx from the API is retried and then surfaces as HTTPError."""
+        requests_seen = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                requests_seen.append(self.path)
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        uploader = DIIPUploader(base_url=f'http://127.0.0.1:{server.server_port}', api_key='test-api-key')
+        with self.assertRaises(requests.HTTPError):
+            uploader._initialize_upload()
+
+        self.assertEqual(requests_seen, ['/upload/init'] * 6)
+
+
 if __name__ == '__main__':
     unittest.main()
 